@@ -1,11 +1,15 @@
+import asyncio
+import functools
+import json
 import os
 import re
 import secrets
+import time
 from contextlib import asynccontextmanager
 from pathlib import Path
 
 import asyncpg
-from fastapi import Depends, FastAPI, HTTPException, Request, status
+from fastapi import Depends, FastAPI, HTTPException, Request, Response, status
 from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.templating import Jinja2Templates
@@ -18,21 +22,102 @@ DB_CONFIG = {
     "database": os.environ.get("DB_NAME", "trakman"),
 }
 
+# Hot leaderboard queries. asyncpg prepares each once per pooled connection and
+# reuses it from the statement cache, so fetch() skips the parse/plan step.
+
+# best_time_fmt is format_time() done in SQL. Nicknames are still stripped in
+# Python: PostgreSQL's regex engine turns the lazy $l[...] match greedy.
+RECORDS_SQL = """
+SELECT map_id, nickname, best_time,
+       (best_time / 60000)::text
+           || ':' || lpad(((best_time % 60000) / 1000)::text, 2, '0')
+           || '.' || lpad((best_time % 1000)::text, 3, '0') AS best_time_fmt
+FROM (
+    SELECT r.map_id, p.nickname, MIN(r.time) AS best_time
+    FROM records r
+    JOIN players p ON p.id = r.player_id
+    WHERE r.map_id = ANY($1)
+    GROUP BY r.map_id, p.id, p.nickname
+) best
+ORDER BY map_id, best_time
+"""
+TIME_WASTED_SQL = (
+    "SELECT nickname, time_played FROM players WHERE time_played > 0 ORDER BY time_played DESC LIMIT 10"
+)
+
 pool: asyncpg.Pool | None = None
+_pool_lock = asyncio.Lock()
 featured_map_ids: set[int] = set()
+# Sorted copy of featured_map_ids for ANY($1), rebuilt whenever the set changes
+featured_map_ids_list: list[int] = []
+# map id -> (stripped name, formatted author time), ordered by name
+featured_maps_meta: dict[int, tuple[str, str]] = {}
+# Bumped whenever the three above change, so in-flight leaderboard builds can tell
+featured_generation = 0
+_featured_maps_lock = asyncio.Lock()
+
+# Every client polls the same leaderboard, so one build serves all of them for a few seconds
+LEADERBOARD_TTL = 3  # seconds
+_leaderboard_cache: dict = {"ts": float("-inf"), "body": b""}  # body is the encoded JSON
+_leaderboard_lock = asyncio.Lock()
+
+# The maps table barely changes during a session; the admin page reuses its list
+ADMIN_MAPS_TTL = 60  # seconds
+_admin_maps_cache: dict = {"ts": float("-inf"), "maps": []}
 
 
 async def get_pool() -> asyncpg.Pool:
     global pool
     if pool is None or pool._closed:
-        pool = await asyncpg.create_pool(**DB_CONFIG, min_size=1, max_size=5)
+        # Concurrent first callers (e.g. gathered queries) must not each create a pool
+        async with _pool_lock:
+            if pool is None or pool._closed:
+                pool = await asyncpg.create_pool(
+                    **DB_CONFIG,
+                    min_size=8,
+                    max_size=32,
+                    command_timeout=5,
+                    statement_cache_size=1024,
+                )
     return pool
 
 
+async def fetch(sql: str, *args) -> list[asyncpg.Record]:
+    """Run a query on its own pooled connection so callers can gather them."""
+    p = await get_pool()
+    async with p.acquire() as conn:
+        return await conn.fetch(sql, *args)
+
+
+async def set_featured_maps(map_ids: set[int]) -> None:
+    """Load the featured maps' display names and author times, then swap them in.
+
+    Nothing changes if the query fails, so the ids and their metadata stay in sync.
+    """
+    global featured_map_ids, featured_map_ids_list, featured_maps_meta, featured_generation
+    ids = sorted(map_ids)
+    async with _featured_maps_lock:
+        maps = await fetch(
+            "SELECT id, name, author_time FROM maps WHERE id = ANY($1) ORDER BY name",
+            ids,
+        )
+        featured_maps_meta = {
+            m["id"]: (strip_tm_formatting(m["name"]), format_time(m["author_time"]))
+            for m in maps
+        }
+        featured_map_ids = set(ids)
+        featured_map_ids_list = ids
+        featured_generation += 1
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     try:
-        await get_pool()
+        # create_pool opens min_size connections up front, so the first request
+        # doesn't pay for connect; SELECT 1 just checks the database answers
+        p = await get_pool()
+        await p.execute("SELECT 1")
+        await set_featured_maps(featured_map_ids)
     except Exception:
         pass  # DB may not be ready yet; pool created lazily on first request
     yield
@@ -45,12 +130,13 @@ templates = Jinja2Templates(directory=Path(__file__).parent / "templates")
 security = HTTPBasic()
 
 ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "")
+_ADMIN_PASSWORD_B = ADMIN_PASSWORD.encode()
 
 
 def verify_admin(credentials: HTTPBasicCredentials = Depends(security)):
     if not ADMIN_PASSWORD:
         raise HTTPException(status_code=503, detail="ADMIN_PASSWORD not configured")
-    if not secrets.compare_digest(credentials.password.encode(), ADMIN_PASSWORD.encode()):
+    if not secrets.compare_digest(credentials.password.encode(), _ADMIN_PASSWORD_B):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials",
@@ -59,9 +145,19 @@ def verify_admin(credentials: HTTPBasicCredentials = Depends(security)):
     return credentials
 
 
+TM_FORMATTING_RE = re.compile(r"\$(?:[0-9a-fA-F]{3}|[lh]\[.*?\]|[lh]|.)")
+
+
+@functools.lru_cache(maxsize=4096)
+def _strip_tm_formatting(text: str) -> str:
+    return TM_FORMATTING_RE.sub("", text)
+
+
 def strip_tm_formatting(text: str) -> str:
     """Strip TrackMania formatting codes ($xxx colors, $o/$i/$s/$z etc)."""
-    return re.sub(r"\$([0-9a-fA-F]{3}|[lh]\[.*?\]|[lh]|.)", "", str(text))
+    if not isinstance(text, str):
+        text = str(text)
+    return _strip_tm_formatting(text)
 
 
 def format_time(ms: int | None) -> str:
@@ -81,17 +177,17 @@ async def healthz():
 
 @app.get("/admin", response_class=HTMLResponse)
 async def admin_page(request: Request, _=Depends(verify_admin)):
-    p = await get_pool()
-    async with p.acquire() as conn:
-        maps = await conn.fetch("SELECT id, name FROM maps ORDER BY name")
+    if time.monotonic() - _admin_maps_cache["ts"] >= ADMIN_MAPS_TTL:
+        maps = await fetch("SELECT id, name FROM maps ORDER BY name")
+        _admin_maps_cache.update(
+            ts=time.monotonic(),
+            maps=[{"id": m["id"], "name": strip_tm_formatting(m["name"])} for m in maps],
+        )
     return templates.TemplateResponse(
         request,
         "admin.html",
         {
-            "maps": [
-                {"id": m["id"], "name": strip_tm_formatting(m["name"])}
-                for m in maps
-            ],
+            "maps": _admin_maps_cache["maps"],
             "featured": featured_map_ids,
         },
     )
@@ -100,57 +196,65 @@ async def admin_page(request: Request, _=Depends(verify_admin)):
 @app.post("/admin")
 async def admin_save(request: Request, _=Depends(verify_admin)):
     form = await request.form()
-    featured_map_ids.clear()
-    for key, val in form.multi_items():
-        if key == "maps":
-            featured_map_ids.add(int(val))
+    await set_featured_maps({int(val) for key, val in form.multi_items() if key == "maps"})
+    _leaderboard_cache["ts"] = float("-inf")
+    _admin_maps_cache["ts"] = float("-inf")
     return RedirectResponse("/admin", status_code=303)
 
 
 @app.get("/api/leaderboard")
 async def api_leaderboard():
-    if not featured_map_ids:
+    body = _leaderboard_cache["body"]
+    if time.monotonic() - _leaderboard_cache["ts"] >= LEADERBOARD_TTL:
+        async with _leaderboard_lock:
+            body = _leaderboard_cache["body"]
+            # Another request may have refreshed the cache while we waited
+            if time.monotonic() - _leaderboard_cache["ts"] >= LEADERBOARD_TTL:
+                generation = featured_generation
+                payload = await build_leaderboard()
+                body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+                # A save during the build already invalidated the cache; don't undo that
+                if generation == featured_generation:
+                    _leaderboard_cache.update(ts=time.monotonic(), body=body)
+    return Response(
+        body,
+        media_type="application/json",
+        headers={"Cache-Control": f"public, max-age={LEADERBOARD_TTL}"},
+    )
+
+
+async def build_leaderboard() -> dict:
+    # Read once: admin_save may swap these while the queries below are awaited
+    map_ids, maps_meta = featured_map_ids_list, featured_maps_meta
+    if not map_ids:
         return {"maps": []}
 
-    p = await get_pool()
-    async with p.acquire() as conn:
-        maps = await conn.fetch(
-            "SELECT id, name, author_time FROM maps WHERE id = ANY($1) ORDER BY name",
-            list(featured_map_ids),
-        )
+    records, time_wasted = await asyncio.gather(
+        fetch(RECORDS_SQL, map_ids),
+        fetch(TIME_WASTED_SQL),  # Toxic stats
+    )
 
-        result = []
-        for m in maps:
-            records = await conn.fetch(
-                """
-                SELECT p.nickname, MIN(r.time) AS best_time
-                FROM records r
-                JOIN players p ON p.id = r.player_id
-                WHERE r.map_id = $1
-                GROUP BY p.id, p.nickname
-                ORDER BY best_time
-                """,
-                m["id"],
-            )
-            result.append({
-                "map_id": m["id"],
-                "name": strip_tm_formatting(m["name"]),
-                "author_time": format_time(m["author_time"]),
-                "records": [
-                    {
-                        "rank": i + 1,
-                        "player": strip_tm_formatting(r["nickname"]),
-                        "time": format_time(r["best_time"]),
-                        "time_ms": r["best_time"],
-                    }
-                    for i, r in enumerate(records)
-                ],
-            })
-
-        # Toxic stats
-        time_wasted = await conn.fetch(
-            "SELECT nickname, time_played FROM players WHERE time_played > 0 ORDER BY time_played DESC LIMIT 10"
-        )
+    records_by_map: dict[int, list] = {}
+    for r in records:
+        records_by_map.setdefault(r["map_id"], []).append(r)
+
+    result = [
+        {
+            "map_id": map_id,
+            "name": name,
+            "author_time": author_time,
+            "records": [
+                {
+                    "rank": i + 1,
+                    "player": strip_tm_formatting(r["nickname"]),
+                    "time": r["best_time_fmt"],
+                    "time_ms": r["best_time"],
+                }
+                for i, r in enumerate(records_by_map.get(map_id, []))
+            ],
+        }
+        for map_id, (name, author_time) in maps_meta.items()
+    ]
 
     return {
         "maps": result,